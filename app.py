@@ -1,23 +1,304 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, Response, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, Response, jsonify, g, stream_with_context
+from werkzeug.security import generate_password_hash, check_password_hash
 import sqlite3
 import csv
 import io
+import json
+import logging
 import os
+import queue
+import threading
+import time
 from datetime import datetime
+from contextlib import contextmanager
+from functools import lru_cache
+
+from session_store import FileSystemSessionInterface
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key'
+# Keep session payloads server-side; only a session id rides on the cookie
+app.session_interface = FileSystemSessionInterface(os.path.join(app.instance_path, 'sessions'))
+# Bulk-action POSTs can carry thousands of checkbox fields; keep the form
+# parser in memory and well above the default part limit
+app.config['MAX_FORM_MEMORY_SIZE'] = 4 * 1024 * 1024
+app.config['MAX_FORM_PARTS'] = 20000
 
 DB_FILE = 'database.db'
 
+# Bump whenever check_and_migrate_database gains a new schema step; startups
+# that find the stamped version skip the whole migration scan
+SCHEMA_VERSION = 5
+
+# Small connection pool shared by all requests: opening/closing the database
+# (plus its -wal/-shm files) on every hit is pure overhead, so connections are
+# kept alive and handed out through flask.g for the duration of a request.
+POOL_SIZE = 5
+_connection_pool = queue.Queue(maxsize=POOL_SIZE)
+
+# WAL lets readers and one writer proceed concurrently and synchronous=NORMAL
+# drops the per-commit fsync that dominates write latency with the default
+# rollback journal. mmap keeps hot pages out of read() syscalls entirely.
+SQLITE_PRAGMAS = (
+    "journal_mode=WAL",
+    "synchronous=NORMAL",
+    "temp_store=MEMORY",
+    "cache_size=-20000",
+    "mmap_size=268435456",
+    "foreign_keys=ON",
+)
+
+
+def _apply_pragmas(conn):
+    """Apply the tuned PRAGMA set to a freshly opened connection"""
+    c = conn.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        c.execute("PRAGMA " + pragma)
+    c.close()
+
+
+def _new_connection():
+    """Create a SQLite connection configured for reuse across requests"""
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False, cached_statements=512)
+    conn.row_factory = sqlite3.Row
+    _apply_pragmas(conn)
+    return conn
+
+
+# Hot-path SQL as module-level constants: every execute() passes the exact
+# same text, so the connection's statement cache skips the parser/planner
+Q_USER_LOGIN = "SELECT id, name, password, role FROM users WHERE name=?"
+Q_LESSON_BY_ID = "SELECT * FROM lessons WHERE id=?"
+Q_PROGRESS_BY_USER_LESSON = "SELECT * FROM student_progress WHERE user_id=? AND lesson_id=?"
+Q_LESSON_WITH_PROGRESS = """SELECT l.*,
+                                   p.id AS progress_id,
+                                   p.completed AS progress_completed,
+                                   p.notes AS progress_notes,
+                                   p.completion_date AS progress_completion_date
+                            FROM lessons l
+                            LEFT JOIN student_progress p
+                                 ON p.lesson_id = l.id AND p.user_id = ?1
+                            WHERE l.id = ?2"""
+Q_PROGRESS_UPSERT = """INSERT INTO student_progress (user_id, lesson_id, completed, completion_date)
+                       VALUES (?, ?, 1, CURRENT_TIMESTAMP)
+                       ON CONFLICT(user_id, lesson_id)
+                       DO UPDATE SET completed=1, completion_date=CURRENT_TIMESTAMP"""
+Q_READING_LOG_BY_USER = "SELECT * FROM reading_log WHERE user_id=? ORDER BY reading_date DESC"
+Q_SCHEDULE_WEEK = "SELECT * FROM schedule WHERE date BETWEEN ? AND ? ORDER BY date"
+# Chronological order for the Québec school year (August through July),
+# usable directly inside ORDER BY so month lists arrive in display order
+# without a Python re-sort
+MONTH_ORDER_SQL = """CASE month
+                        WHEN 'août' THEN 1 WHEN 'septembre' THEN 2
+                        WHEN 'octobre' THEN 3 WHEN 'novembre' THEN 4
+                        WHEN 'décembre' THEN 5 WHEN 'janvier' THEN 6
+                        WHEN 'février' THEN 7 WHEN 'mars' THEN 8
+                        WHEN 'avril' THEN 9 WHEN 'mai' THEN 10
+                        WHEN 'juin' THEN 11 WHEN 'juillet' THEN 12
+                        ELSE 13 END"""
+
+# Fixed-shape list queries: every filter is always bound (with '' as the
+# no-filter sentinel) so the SQL text is identical across requests and the
+# connection's prepared-statement cache always hits
+_LESSON_LIST_COLUMNS = ("lessons.id, lessons.month, lessons.week_number,"
+                        " lessons.day_number, lessons.title,"
+                        " substr(lessons.content, 1, 150) AS excerpt,"
+                        " lessons.duration")
+Q_LESSONS_LIST = f"""SELECT {_LESSON_LIST_COLUMNS} FROM lessons
+                     WHERE subject = :subject
+                       AND (:month = '' OR month = :month)
+                       AND (:q = '' OR title LIKE :q_like OR content LIKE :q_like)
+                     ORDER BY subject, title"""
+Q_LESSONS_SEARCH = f"""SELECT {_LESSON_LIST_COLUMNS} FROM lessons
+                       JOIN lessons_fts f ON f.rowid = lessons.id
+                       WHERE lessons.subject = :subject
+                         AND lessons_fts MATCH :match
+                         AND (:month = '' OR lessons.month = :month)
+                       ORDER BY lessons.subject, lessons.title"""
+# Bulk-action dispatch: per-id statements run with executemany inside one
+# transaction; value_field names the form field bound ahead of the id
+BULK_ACTIONS = {
+    'delete': {
+        'statements': ("DELETE FROM lessons WHERE id=?",),
+        'value_field': None,
+        'message': "{n} leçons supprimées",
+    },
+    'update_month': {
+        'statements': ("UPDATE lessons SET month=? WHERE id=?",),
+        'value_field': 'new_month',
+        'message': "{n} leçons mises à jour (mois: {value})",
+    },
+}
+
+
+# Selections at or past this size run in a background thread so the POST
+# returns immediately; WAL lets the worker write while readers proceed
+BULK_ASYNC_THRESHOLD = 500
+
+
+def _execute_bulk(conn, spec, lesson_ids, value):
+    """Run one BULK_ACTIONS spec in a single transaction; returns rowcount
+    of the final statement (the lessons table one)"""
+    c = conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    params = ([(value, lid) for lid in lesson_ids] if value
+              else [(lid,) for lid in lesson_ids])
+    affected = 0
+    for sql in spec['statements']:
+        c.executemany(sql, params)
+        affected = c.rowcount
+    conn.commit()
+    _bump_lessons_version()
+    return affected
+
+
+def _bulk_action_worker(spec, lesson_ids, value, action):
+    """Background body for large bulk actions, on its own connection"""
+    conn = _new_connection()
+    try:
+        affected = _execute_bulk(conn, spec, lesson_ids, value)
+        logger.info("Background bulk action %r finished: %d lessons",
+                    action, affected)
+    except sqlite3.DatabaseError:
+        conn.rollback()
+        logger.exception("Background bulk action %r failed", action)
+    finally:
+        conn.close()
+
+
+def _bulk_update_pairs(c, column, pairs):
+    """Apply per-row values in one statement per chunk of (id, value) pairs.
+
+    Collapses a heterogeneous bulk edit into UPDATE ... SET col = CASE id
+    ... END WHERE id IN (...) so a batch costs one parse/plan instead of one
+    statement per row. column must be a trusted identifier, never user
+    input. Chunked to stay well under SQLite's bound-parameter limit.
+    """
+    if column not in {'month', 'subject', 'tags'}:
+        raise ValueError(f"unexpected bulk update column: {column}")
+    CHUNK = 400
+    for i in range(0, len(pairs), CHUNK):
+        chunk = pairs[i:i + CHUNK]
+        cases = ' '.join('WHEN ? THEN ?' for _ in chunk)
+        placeholders = ','.join('?' for _ in chunk)
+        args = [x for pair in chunk for x in pair] + [pair[0] for pair in chunk]
+        c.execute(f"UPDATE lessons SET {column} = CASE id {cases} END"
+                  f" WHERE id IN ({placeholders})", args)
+
+
+def get_db():
+    """Return the request-scoped database connection, reusing pooled ones"""
+    if 'db' not in g:
+        try:
+            g.db = _connection_pool.get_nowait()
+        except queue.Empty:
+            g.db = _new_connection()
+    return g.db
+
+
+# In-process TTL cache for near-static query results (calendar weeks,
+# filter dropdowns). Writers invalidate by key prefix after committing.
+CACHE_TTL = 300
+CACHE_MAX_ENTRIES = 1024
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _cache_get(key):
+    """Return a cached value or None if absent/expired"""
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del _cache[key]
+            return None
+        return value
+
+
+def _cache_set(key, value, timeout=CACHE_TTL):
+    """Store a value under key for timeout seconds.
+
+    Keys embed user input (search strings) and version counters, so most
+    entries are never read again after they expire; when the dict fills up,
+    sweep the expired ones and, if live entries alone exceed the cap, drop
+    the soonest-to-expire so the cache cannot grow without bound.
+    """
+    with _cache_lock:
+        if len(_cache) >= CACHE_MAX_ENTRIES:
+            now = time.monotonic()
+            for k in [k for k, (expires, _) in _cache.items() if expires < now]:
+                del _cache[k]
+            if len(_cache) >= CACHE_MAX_ENTRIES:
+                for k, _ in sorted(_cache.items(), key=lambda kv: kv[1][0])[:CACHE_MAX_ENTRIES // 2]:
+                    del _cache[k]
+        _cache[key] = (time.monotonic() + timeout, value)
+
+
+def _cache_invalidate(prefix=''):
+    """Drop every cached entry whose key starts with prefix"""
+    with _cache_lock:
+        for key in [k for k in _cache if k.startswith(prefix)]:
+            del _cache[key]
+
+
+@contextmanager
+def _write_tx(conn):
+    """Run a block of writes as one BEGIN IMMEDIATE transaction.
+
+    Taking the write lock up front avoids the deferred-to-reserved lock
+    promotion of sqlite3's implicit transactions under contention; commit
+    and rollback bookkeeping live here instead of in every handler.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn.cursor()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+@app.teardown_appcontext
+def close_db(exception=None):
+    """Give the request's connection back to the pool instead of closing it"""
+    conn = g.pop('db', None)
+    if conn is None:
+        return
+    # A handler that caught a DML error may leave the implicit transaction
+    # open; repooling it like that would hold the write lock forever and
+    # wedge every later write. Rolling back here also drops any leftover
+    # TEMP tables from aborted imports.
+    if conn.in_transaction:
+        conn.rollback()
+    try:
+        _connection_pool.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
 
 def check_and_migrate_database():
     """
     Check if database needs migration and perform it if necessary
     """
     conn = sqlite3.connect(DB_FILE)
+    # Larger pages amortize syscall and mmap-fault overhead on this mostly
+    # multi-KB-TEXT workload. Must run before _apply_pragmas switches the
+    # file to WAL, after which the page size is frozen; only takes effect
+    # while the file is still empty.
+    conn.execute("PRAGMA page_size=8192")
+    _apply_pragmas(conn)
     c = conn.cursor()
-    
+
+    # Schema already current: skip the table_info/count probes entirely
+    c.execute("PRAGMA user_version")
+    if c.fetchone()[0] >= SCHEMA_VERSION:
+        conn.close()
+        return
+
     try:
         # Check if users table exists and has correct structure
         c.execute("PRAGMA table_info(users)")
@@ -28,55 +309,52 @@ def check_and_migrate_database():
         if not columns:
             # Table doesn't exist
             needs_migration = True
-            print("🔧 Users table doesn't exist, creating...")
+            logger.info("Users table doesn't exist, creating...")
         elif 'name' not in columns:
             # Table exists but has wrong structure
             needs_migration = True
-            print("🔧 Users table needs migration...")
+            logger.info("Users table needs migration...")
         
         if needs_migration:
-            # Get existing data if table exists
-            existing_users = []
-            try:
-                c.execute("SELECT * FROM users")
-                existing_users = c.fetchall()
-                print(f"📊 Found {len(existing_users)} existing users")
-            except:
-                print("📊 No existing users found")
-            
-            # Drop and recreate users table
-            c.execute("DROP TABLE IF EXISTS users")
-            c.execute('''
-                CREATE TABLE users (
+            users_columns = '''(
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     name TEXT NOT NULL UNIQUE,
                     password TEXT NOT NULL,
                     role TEXT DEFAULT 'teacher',
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Migrate existing data if any
-            for user in existing_users:
-                try:
-                    # Try different possible old schemas
-                    if len(user) >= 2:
-                        # Assume first column is ID, second is username/name, third is password
-                        user_id, username = user[0], user[1]
-                        password = user[2] if len(user) > 2 else 'password123'  # default password
-                        
-                        c.execute(
-                            "INSERT INTO users (name, password, role) VALUES (?, ?, ?)",
-                            (str(username), str(password), 'teacher')
-                        )
-                        print(f"✅ Migrated user: {username}")
-                except Exception as e:
-                    print(f"⚠️  Error migrating user {user}: {e}")
-            
-            print("✅ Users table migration completed")
+                )'''
+
+            if not columns:
+                c.execute("CREATE TABLE users " + users_columns)
+            else:
+                # Snapshot the database before the destructive rebuild
+                backup = sqlite3.connect(DB_FILE + '.pre_migration')
+                with backup:
+                    conn.backup(backup)
+                backup.close()
+
+                # Move rows engine-side with INSERT ... SELECT instead of
+                # round-tripping every user through Python. Old schemas are
+                # mapped by convention: second column is the username, third
+                # the password, matching the previous migration heuristic.
+                name_col = 'username' if 'username' in columns else (columns[1] if len(columns) > 1 else None)
+                password_expr = 'password' if 'password' in columns else (columns[2] if len(columns) > 2 else "'password123'")
+
+                c.execute("CREATE TABLE users_new " + users_columns)
+                c.execute("BEGIN")
+                if name_col:
+                    c.execute(f"""INSERT INTO users_new (name, password, role)
+                                  SELECT {name_col}, {password_expr}, 'teacher' FROM users""")
+                    logger.info("Migrated %d users", c.rowcount)
+                c.execute("DROP TABLE users")
+                c.execute("ALTER TABLE users_new RENAME TO users")
+                conn.commit()
+
+            logger.info("Users table migration completed")
         
-        # Create other tables
-        c.execute('''
+        # Create the remaining tables in one executescript call: a single
+        # C-level dispatch instead of a dozen execute() round-trips
+        c.executescript('''
             CREATE TABLE IF NOT EXISTS lessons (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 month TEXT NOT NULL,
@@ -91,28 +369,8 @@ def check_and_migrate_database():
                 subject TEXT DEFAULT 'français',
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Add subject column if it doesn't exist (for existing databases)
-        try:
-            c.execute("ALTER TABLE lessons ADD COLUMN subject TEXT DEFAULT 'français'")
-        except sqlite3.OperationalError:
-            pass  # Column already exists
-            
-        # Add lesson_date column if it doesn't exist
-        try:
-            c.execute("ALTER TABLE lessons ADD COLUMN lesson_date TEXT")
-        except sqlite3.OperationalError:
-            pass  # Column already exists
-            
-        # Add period column if it doesn't exist
-        try:
-            c.execute("ALTER TABLE lessons ADD COLUMN period TEXT")
-        except sqlite3.OperationalError:
-            pass  # Column already exists
-        
-        c.execute('''
+            );
+
             CREATE TABLE IF NOT EXISTS student_progress (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER,
@@ -121,11 +379,9 @@ def check_and_migrate_database():
                 notes TEXT,
                 completion_date TIMESTAMP,
                 FOREIGN KEY (user_id) REFERENCES users (id),
-                FOREIGN KEY (lesson_id) REFERENCES lessons (id)
-            )
-        ''')
-        
-        c.execute('''
+                FOREIGN KEY (lesson_id) REFERENCES lessons (id) ON DELETE CASCADE
+            );
+
             CREATE TABLE IF NOT EXISTS reading_log (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER,
@@ -137,10 +393,8 @@ def check_and_migrate_database():
                 notes TEXT,
                 rating INTEGER CHECK(rating >= 1 AND rating <= 5),
                 FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        c.execute('''
+            );
+
             CREATE TABLE IF NOT EXISTS evaluations (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER,
@@ -152,13 +406,8 @@ def check_and_migrate_database():
                 date_evaluated DATE,
                 comments TEXT,
                 FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        # New tables for the three functionalities
-        
-        # Theory: Theoretical lessons with exercises
-        c.execute('''
+            );
+
             CREATE TABLE IF NOT EXISTS theory (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 lesson_id INTEGER,
@@ -170,11 +419,8 @@ def check_and_migrate_database():
                 discipline TEXT DEFAULT 'français',
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (lesson_id) REFERENCES lessons (id)
-            )
-        ''')
-        
-        # Exercises linked to lessons
-        c.execute('''
+            );
+
             CREATE TABLE IF NOT EXISTS exercises (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 lesson_id INTEGER,
@@ -189,11 +435,8 @@ def check_and_migrate_database():
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (lesson_id) REFERENCES lessons (id),
                 FOREIGN KEY (theory_id) REFERENCES theory (id)
-            )
-        ''')
-        
-        # Portfolio, Examens et Travaux
-        c.execute('''
+            );
+
             CREATE TABLE IF NOT EXISTS portfolio_items (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER,
@@ -213,11 +456,8 @@ def check_and_migrate_database():
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (user_id) REFERENCES users (id),
                 FOREIGN KEY (lesson_id) REFERENCES lessons (id)
-            )
-        ''')
-        
-        # User exercise attempts
-        c.execute('''
+            );
+
             CREATE TABLE IF NOT EXISTS exercise_attempts (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
@@ -230,11 +470,8 @@ def check_and_migrate_database():
                 attempted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (user_id) REFERENCES users (id),
                 FOREIGN KEY (exercise_id) REFERENCES exercises (id)
-            )
-        ''')
-        
-        # Grammar gender exercises - Question database
-        c.execute('''
+            );
+
             CREATE TABLE IF NOT EXISTS grammar_gender_questions (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 sub_question_id TEXT UNIQUE NOT NULL,
@@ -246,11 +483,8 @@ def check_and_migrate_database():
                 exemple_usage_universitaire TEXT,
                 terminaisons TEXT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Grammar gender exercise sessions
-        c.execute('''
+            );
+
             CREATE TABLE IF NOT EXISTS grammar_gender_sessions (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
@@ -263,11 +497,8 @@ def check_and_migrate_database():
                 completed_at TIMESTAMP,
                 status TEXT DEFAULT 'active' CHECK(status IN ('active', 'completed', 'paused')),
                 FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        # Individual question attempts within sessions
-        c.execute('''
+            );
+
             CREATE TABLE IF NOT EXISTS grammar_gender_attempts (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 session_id INTEGER NOT NULL,
@@ -280,11 +511,8 @@ def check_and_migrate_database():
                 attempted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (session_id) REFERENCES grammar_gender_sessions (id),
                 FOREIGN KEY (question_id) REFERENCES grammar_gender_questions (id)
-            )
-        ''')
-        
-        # Question flagging system
-        c.execute('''
+            );
+
             CREATE TABLE IF NOT EXISTS question_flags (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 question_id TEXT NOT NULL,
@@ -298,9 +526,58 @@ def check_and_migrate_database():
                 reviewed_by INTEGER,
                 FOREIGN KEY (user_id) REFERENCES users (id),
                 FOREIGN KEY (reviewed_by) REFERENCES users (id)
-            )
+            );
         ''')
-        
+
+        # Rebuild pre-cascade student_progress tables so deleting a lesson
+        # removes its progress rows in the same statement. Orphans from the
+        # two-DELETE era are filtered out during the copy; the rename drags
+        # the old index and triggers along, and the IF NOT EXISTS statements
+        # further down recreate them against the new table.
+        c.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='student_progress'")
+        if 'ON DELETE CASCADE' not in c.fetchone()[0]:
+            logger.info("Rebuilding student_progress with ON DELETE CASCADE...")
+            c.execute("PRAGMA foreign_keys = OFF")
+            c.executescript('''
+                ALTER TABLE student_progress RENAME TO student_progress_old;
+                CREATE TABLE student_progress (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    lesson_id INTEGER,
+                    completed BOOLEAN DEFAULT FALSE,
+                    notes TEXT,
+                    completion_date TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (id),
+                    FOREIGN KEY (lesson_id) REFERENCES lessons (id) ON DELETE CASCADE
+                );
+                INSERT INTO student_progress
+                SELECT * FROM student_progress_old
+                WHERE (lesson_id IS NULL OR lesson_id IN (SELECT id FROM lessons))
+                  AND (user_id IS NULL OR user_id IN (SELECT id FROM users));
+                DROP TABLE student_progress_old;
+            ''')
+            c.execute("PRAGMA foreign_keys = ON")
+            conn.commit()
+
+        # Add columns that predate CREATE TABLE IF NOT EXISTS (for existing databases)
+        try:
+            c.execute("ALTER TABLE lessons ADD COLUMN subject TEXT DEFAULT 'français'")
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+        try:
+            c.execute("ALTER TABLE lessons ADD COLUMN lesson_date TEXT")
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+        try:
+            c.execute("ALTER TABLE lessons ADD COLUMN period TEXT")
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+
+        try:
+            c.execute("ALTER TABLE lessons ADD COLUMN content_json TEXT")
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+
         conn.commit()
         
         # Add new columns for scoring system if they don't exist
@@ -315,8 +592,8 @@ def check_and_migrate_database():
             pass  # Column already exists
         
         # Insert sample grammar gender questions if table is empty
-        c.execute("SELECT COUNT(*) FROM grammar_gender_questions")
-        if c.fetchone()[0] == 0:
+        c.execute("SELECT 1 FROM grammar_gender_questions LIMIT 1")
+        if c.fetchone() is None:
             sample_questions = [
                 ("QAG1-1", "soleil", "masculin", 3, "Un soleil radieux brille dans le ciel", 
                  "Le soleil, ce dieu d'or, s'endort dans son royaume pourpre", 
@@ -353,24 +630,24 @@ def check_and_migrate_database():
             conn.commit()
         
         # Insert sample lesson data if table is empty
-        c.execute("SELECT COUNT(*) FROM lessons")
-        if c.fetchone()[0] == 0:
+        c.execute("SELECT 1 FROM lessons LIMIT 1")
+        if c.fetchone() is None:
             sample_lessons = [
                 ("septembre", 1, 1, "🎯 Accueil et présentation du programme", 
                  "Amorce (10 min) : Jeu brise-glace \"Qui suis-je littéraire ?\"\nDéveloppement (50 min) :\n• Présentation des 3 compétences PFEQ (15 min)\n• Survol des œuvres à lire cette année + extraits (20 min)\n• Explication système d'évaluation et portfolios (15 min)\nIntégration (15 min) : Questions-réponses et anticipations",
-                 75, "Oral", "Extraits d'œuvres, grille d'évaluation, cahiers", "Créer un climat de confiance et présenter les attentes", "oral", "français", "2024-09-03", "1"),
+                 75, "Extraits d'œuvres, grille d'évaluation, cahiers", "Créer un climat de confiance et présenter les attentes", "oral", "français", "2024-09-03", "1"),
                 ("septembre", 1, 2, "📖 Évaluation diagnostique - Lecture",
                  "Amorce (5 min) : Rappel des stratégies de lecture\nDéveloppement (60 min) :\n• Test de compréhension de lecture - 2 textes variés (45 min)\n• Questionnaire métacognitif sur les stratégies utilisées (15 min)\nIntégration (10 min) : Autoévaluation de la performance",
-                 75, "Lecture", "Cahier de textes diagnostiques, grille d'observation", "Évaluer les forces/défis en compréhension de lecture", "lecture,evaluation", "français", "2024-09-04", "2"),
+                 75, "Cahier de textes diagnostiques, grille d'observation", "Évaluer les forces/défis en compréhension de lecture", "lecture,evaluation", "français", "2024-09-04", "2"),
                 ("septembre", 1, 3, "✍️ Évaluation diagnostique - Écriture",
                  "Amorce (10 min) : Remue-méninges sur les caractéristiques du texte descriptif\nDéveloppement (55 min) :\n• Rédaction d'un texte descriptif de 150 mots : \"Mon lieu préféré\" (40 min)\n• Relecture et révision autonome (15 min)\nIntégration (10 min) : Remise et réflexion sur le processus d'écriture",
-                 75, "Écriture", "Feuilles mobiles, aide-mémoire descriptif", "Évaluer les compétences de base en écriture descriptive", "ecriture,evaluation", "français", "2024-09-05", "3"),
+                 75, "Feuilles mobiles, aide-mémoire descriptif", "Évaluer les compétences de base en écriture descriptive", "ecriture,evaluation", "français", "2024-09-05", "3"),
                 ("septembre", 1, 4, "📚 Introduction au carnet de lecture",
                  "Amorce (15 min) : Discussion sur les habitudes de lecture des élèves\nDéveloppement (50 min) :\n• Présentation du carnet de lecture et de ses composantes (15 min)\n• Création et personnalisation du carnet (20 min)\n• Première entrée : \"Mes goûts littéraires\" (15 min)\nIntégration (10 min) : Choix du premier roman + planification lecture",
-                 75, "Lecture", "Cahiers, liste romans disponibles, exemples carnets", "Établir l'outil de suivi des lectures personnelles", "lecture", "français", "2024-09-06", "4"),
+                 75, "Cahiers, liste romans disponibles, exemples carnets", "Établir l'outil de suivi des lectures personnelles", "lecture", "français", "2024-09-06", "4"),
                 ("septembre", 1, 5, "🦊 Bilan de la semaine + Introduction aux fables",
                  "Amorce (20 min) : Retour sur la semaine, partage des impressions\nDéveloppement (45 min) :\n• Lecture expressive de \"Le Corbeau et le Renard\" (10 min)\n• Compréhension globale et première analyse (15 min)\n• Introduction au concept de fable et de morale (20 min)\nIntégration (10 min) : Anticipation de la suite du programme",
-                 75, "Lecture", "Recueil de fables, tableau des caractéristiques", "Clôturer positivement la première semaine", "lecture,oral", "français", "2024-09-07", "1"),
+                 75, "Recueil de fables, tableau des caractéristiques", "Clôturer positivement la première semaine", "lecture,oral", "français", "2024-09-07", "1"),
             ]
             
             c.executemany('''
@@ -378,17 +655,342 @@ def check_and_migrate_database():
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', sample_lessons)
             conn.commit()
-        
+
+        # Indexes for the per-request lookups (dashboard counts, lesson
+        # progress, reading log). Created after the seed inserts so bulk
+        # loading does not pay per-row index maintenance. users.name already
+        # has an implicit index from its UNIQUE constraint.
+        # Deduplicate progress rows first so the unique index can build.
+        c.execute('''
+            DELETE FROM student_progress WHERE id NOT IN (
+                SELECT MIN(id) FROM student_progress GROUP BY user_id, lesson_id
+            )
+        ''')
+        c.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_sp_user_lesson
+            ON student_progress(user_id, lesson_id)
+        ''')
+        c.execute('''
+            CREATE INDEX IF NOT EXISTS idx_rl_user_date
+            ON reading_log(user_id, reading_date DESC)
+        ''')
+        c.execute('''
+            CREATE INDEX IF NOT EXISTS idx_lessons_subject_month
+            ON lessons(subject, month)
+        ''')
+        c.execute('''
+            CREATE INDEX IF NOT EXISTS idx_eval_user
+            ON evaluations(user_id)
+        ''')
+        # Covering indexes for the math routes: the week_number GROUP BYs
+        # and the per-user completion joins read everything they need from
+        # the index, no row fetches. (There is no competences column on
+        # lessons; tags is what those queries aggregate.)
+        c.execute('''
+            CREATE INDEX IF NOT EXISTS idx_lessons_subject_week
+            ON lessons(subject, week_number, tags)
+        ''')
+        c.execute('''
+            CREATE INDEX IF NOT EXISTS idx_sp_user_lesson_completed
+            ON student_progress(user_id, lesson_id, completed)
+        ''')
+        # Refresh planner statistics so the new indexes actually get picked
+        c.execute("ANALYZE")
+        conn.commit()
+
+        # Materialized per-user statistics, kept current by triggers so the
+        # dashboard does a primary-key lookup instead of aggregate scans
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS user_stats (
+                user_id INTEGER PRIMARY KEY,
+                completed_lessons INTEGER DEFAULT 0,
+                books_read INTEGER DEFAULT 0,
+                sum_rating REAL DEFAULT 0,
+                n_rating INTEGER DEFAULT 0
+            )
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_stats_sp_insert
+            AFTER INSERT ON student_progress BEGIN
+                INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.user_id);
+                UPDATE user_stats SET completed_lessons = completed_lessons + (NEW.completed = 1)
+                WHERE user_id = NEW.user_id;
+            END
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_stats_sp_update
+            AFTER UPDATE OF completed ON student_progress BEGIN
+                UPDATE user_stats SET completed_lessons = completed_lessons + (NEW.completed = 1) - (OLD.completed = 1)
+                WHERE user_id = NEW.user_id;
+            END
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_stats_sp_delete
+            AFTER DELETE ON student_progress BEGIN
+                UPDATE user_stats SET completed_lessons = completed_lessons - (OLD.completed = 1)
+                WHERE user_id = OLD.user_id;
+            END
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_stats_rl_insert
+            AFTER INSERT ON reading_log BEGIN
+                INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.user_id);
+                UPDATE user_stats SET books_read = books_read + 1,
+                                      sum_rating = sum_rating + COALESCE(NEW.rating, 0),
+                                      n_rating = n_rating + (NEW.rating IS NOT NULL)
+                WHERE user_id = NEW.user_id;
+            END
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_stats_rl_delete
+            AFTER DELETE ON reading_log BEGIN
+                UPDATE user_stats SET books_read = books_read - 1,
+                                      sum_rating = sum_rating - COALESCE(OLD.rating, 0),
+                                      n_rating = n_rating - (OLD.rating IS NOT NULL)
+                WHERE user_id = OLD.user_id;
+            END
+        ''')
+
+        # Backfill stats for data written before the triggers existed
+        c.execute("SELECT 1 FROM user_stats LIMIT 1")
+        if c.fetchone() is None:
+            c.execute('''
+                INSERT INTO user_stats (user_id, completed_lessons, books_read, sum_rating, n_rating)
+                SELECT u.id,
+                       (SELECT COUNT(*) FROM student_progress sp WHERE sp.user_id = u.id AND sp.completed = 1),
+                       (SELECT COUNT(*) FROM reading_log rl WHERE rl.user_id = u.id),
+                       (SELECT COALESCE(SUM(rating), 0) FROM reading_log rl WHERE rl.user_id = u.id),
+                       (SELECT COUNT(rating) FROM reading_log rl WHERE rl.user_id = u.id)
+                FROM users u
+            ''')
+
+        # Full-text shadow table so lesson search uses an inverted index
+        # instead of LIKE '%...%' table scans. remove_diacritics 2 lets
+        # accent-free input match the French corpus.
+        c.execute("SELECT 1 FROM sqlite_master WHERE name='lessons_fts'")
+        fts_missing = c.fetchone() is None
+        c.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS lessons_fts USING fts5(
+                title, content,
+                content='lessons', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_lessons_fts_insert
+            AFTER INSERT ON lessons BEGIN
+                INSERT INTO lessons_fts (rowid, title, content)
+                VALUES (NEW.id, NEW.title, NEW.content);
+            END
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_lessons_fts_delete
+            AFTER DELETE ON lessons BEGIN
+                INSERT INTO lessons_fts (lessons_fts, rowid, title, content)
+                VALUES ('delete', OLD.id, OLD.title, OLD.content);
+            END
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_lessons_fts_update
+            AFTER UPDATE OF title, content ON lessons BEGIN
+                INSERT INTO lessons_fts (lessons_fts, rowid, title, content)
+                VALUES ('delete', OLD.id, OLD.title, OLD.content);
+                INSERT INTO lessons_fts (rowid, title, content)
+                VALUES (NEW.id, NEW.title, NEW.content);
+            END
+        ''')
+        if fts_missing:
+            # Index lessons written before the triggers existed
+            c.execute("INSERT INTO lessons_fts (lessons_fts) VALUES ('rebuild')")
+
+        # Stamp the schema so the next startup takes the fast path above
+        c.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+        conn.commit()
+
     except Exception as e:
-        print(f"❌ Database initialization failed: {e}")
+        logger.error("Database initialization failed: %s", e)
         conn.rollback()
         raise
     finally:
         conn.close()
 
-def init_db():
-    """Initialize database with migration check"""
-    check_and_migrate_database()
+_init_lock = threading.Lock()
+_initialized = False
+
+
+def init_db(warm_pool=True):
+    """Initialize database with migration check and warm the connection pool
+
+    Idempotent and safe to call from several places (wsgi entrypoint,
+    __main__, tests): the sentinel makes repeat calls free and the lock
+    keeps threads from racing the migration or double-filling the pool.
+
+    Pass warm_pool=False when this runs before a fork (gunicorn --preload):
+    SQLite connections must never be carried across fork(), so a preloading
+    master should only migrate and let each worker fill its pool lazily
+    through get_db.
+    """
+    global _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if _initialized:
+            return
+        check_and_migrate_database()
+
+        # Open the pooled connections up front so the first requests after
+        # boot don't each pay connect+pragma setup
+        if warm_pool:
+            while True:
+                try:
+                    _connection_pool.put_nowait(_new_connection())
+                except queue.Full:
+                    break
+        _initialized = True
+
+# Lesson contents follow a consistent "Amorce / Développement / Intégration"
+# layout; split once, persist the result in lessons.content_json and keep the
+# parsed structure in an LRU cache instead of re-parsing per page view
+CONTENT_SECTION_PREFIXES = ('Amorce', 'Développement', 'Intégration')
+
+
+def _split_content_sections(content):
+    """Split lesson content into (heading, body) pairs, or None if unstructured"""
+    sections = []
+    current = None
+    for line in content.splitlines():
+        if line.startswith(CONTENT_SECTION_PREFIXES):
+            heading, _, rest = line.partition(' : ')
+            current = [heading, [rest] if rest else []]
+            sections.append(current)
+        elif current is not None:
+            current[1].append(line)
+    if not sections:
+        return None
+    return [(heading, '\n'.join(body).strip()) for heading, body in sections]
+
+
+@lru_cache(maxsize=256)
+def _parsed_lesson_content(lesson_id):
+    """Return the cached section structure for a lesson's content"""
+    c = get_db().cursor()
+    c.execute("SELECT content, content_json FROM lessons WHERE id=?", (lesson_id,))
+    row = c.fetchone()
+    if row is None or not row['content']:
+        return None
+    if row['content_json']:
+        return json.loads(row['content_json'])
+    sections = _split_content_sections(row['content'])
+    if sections:
+        conn = get_db()
+        conn.execute("UPDATE lessons SET content_json=? WHERE id=?",
+                     (json.dumps(sections), lesson_id))
+        conn.commit()
+    return sections
+
+
+# Lessons change only through create/edit/duplicate/delete/import; dropdown
+# queries carry this version in their cache key so any write instantly
+# expires cached readers, with the TTL as a fallback
+_lessons_version = 0
+
+
+def _bump_lessons_version():
+    global _lessons_version
+    _lessons_version += 1
+
+
+def _distinct_months(subject):
+    """Months having lessons for a subject, cached until lessons change"""
+    key = f"lessons:{_lessons_version}:months:{subject}"
+    months = _cache_get(key)
+    if months is None:
+        c = get_db().cursor()
+        c.execute("SELECT DISTINCT month FROM lessons WHERE subject = ?"
+                  f" ORDER BY {MONTH_ORDER_SQL}", (subject,))
+        months = [row[0] for row in c.fetchall()]
+        _cache_set(key, months, timeout=60)
+    return months
+
+
+def _available_subjects():
+    """Distinct lesson subjects, cached until lessons change"""
+    key = f"lessons:{_lessons_version}:subjects"
+    subjects = _cache_get(key)
+    if subjects is None:
+        c = get_db().cursor()
+        c.execute("SELECT DISTINCT subject FROM lessons WHERE subject IS NOT NULL ORDER BY subject")
+        subjects = [row[0] for row in c.fetchall()]
+        _cache_set(key, subjects, timeout=60)
+    return subjects
+
+
+_lessons_list_url_cache = None
+
+
+def _lessons_list_url():
+    """lessons_list redirect target, built once instead of per url_for call
+
+    The route takes no arguments, so the URL never varies; caching it skips
+    a URL-map walk on every bulk-action PRG redirect.
+    """
+    global _lessons_list_url_cache
+    if _lessons_list_url_cache is None:
+        _lessons_list_url_cache = url_for('lessons_list')
+    return _lessons_list_url_cache
+
+
+def _stream_csv(cursor, header):
+    """Yield CSV lines for header plus every cursor row, O(1) memory.
+
+    Rows pass through one small reusable buffer straight off the cursor,
+    so the download starts immediately and peak heap stays constant no
+    matter how many rows the query returns.
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(header)
+    yield buf.getvalue()
+    buf.seek(0)
+    buf.truncate()
+    for row in cursor:
+        writer.writerow(tuple(row))
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+
+def _fts_match_query(search_query):
+    """Build a safe FTS5 MATCH expression from raw user input.
+
+    Each word is double-quoted so FTS operators in the input stay literal,
+    and the last word gets a prefix star so typing feels like substring
+    search. Returns None for input too short to index usefully; callers
+    then fall back to LIKE.
+    """
+    words = [w.replace('"', '') for w in search_query.split()]
+    words = [w for w in words if w]
+    if not words or max(len(w) for w in words) < 3:
+        return None
+    quoted = [f'"{w}"' for w in words]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def _verify_password(candidate, stored, user_id):
+    """Check a login password, upgrading legacy plaintext rows in place"""
+    if stored.startswith(('pbkdf2:', 'scrypt:')):
+        return check_password_hash(stored, candidate)
+    # Legacy plaintext row: compare directly and store a proper hash so the
+    # slow KDF path only ever runs once per login attempt
+    if candidate == stored:
+        conn = get_db()
+        conn.execute("UPDATE users SET password=? WHERE id=?",
+                     (generate_password_hash(candidate), user_id))
+        conn.commit()
+        return True
+    return False
+
 
 @app.route('/')
 def index():
@@ -401,15 +1003,13 @@ def login():
     if request.method == 'POST':
         name = request.form['name']
         password = request.form['password']
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("SELECT * FROM users WHERE name=? AND password=?", (name, password))
+        c = get_db().cursor()
+        c.execute(Q_USER_LOGIN, (name,))
         user = c.fetchone()
-        conn.close()
-        if user:
+        if user and _verify_password(password, user['password'], user['id']):
             session['user'] = name
-            session['user_id'] = user[0]
-            session['role'] = user[3] if len(user) > 3 else 'teacher'
+            session['user_id'] = user['id']
+            session['role'] = user['role'] or 'teacher'
             return redirect(url_for('discipline_selection'))
         else:
             flash("Nom d'utilisateur ou mot de passe incorrect", 'error')
@@ -423,19 +1023,16 @@ def register():
         password = request.form['password']
         role = request.form.get('role', 'teacher')
         
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
         try:
-            c.execute("INSERT INTO users (name, password, role) VALUES (?, ?, ?)", (name, password, role))
-            conn.commit()
+            with _write_tx(get_db()) as c:
+                c.execute("INSERT INTO users (name, password, role) VALUES (?, ?, ?)",
+                          (name, generate_password_hash(password), role))
             flash("Compte créé avec succès! Vous pouvez maintenant vous connecter.", 'success')
             return redirect(url_for('login'))
         except sqlite3.IntegrityError:
             flash("Ce nom d'utilisateur existe déjà", 'error')
         except Exception as e:
             flash(f"Erreur lors de la création du compte: {e}", 'error')
-        finally:
-            conn.close()
     return render_template('register.html')
 
 @app.route('/discipline-selection')
@@ -464,26 +1061,7 @@ def calendar():
     
     # Get week parameter or default to current week
     week_offset = int(request.args.get('week', 0))
-    
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    # Create schedule table if it doesn't exist
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS schedule (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            date TEXT NOT NULL,
-            day_of_week TEXT,
-            day_number INTEGER,
-            event_type TEXT,
-            p1_course TEXT,
-            p2_course TEXT,
-            p3_course TEXT,
-            p4_course TEXT,
-            UNIQUE(date)
-        )
-    ''')
-    
+
     # Get current date and calculate week start
     today = datetime.now().date()
     # Find Monday of current week
@@ -491,31 +1069,59 @@ def calendar():
     current_monday = today - timedelta(days=days_since_monday)
     # Apply week offset
     target_monday = current_monday + timedelta(weeks=week_offset)
-    
+
     # Generate week dates
     week_dates = []
     for i in range(7):  # Monday to Sunday
         week_dates.append(target_monday + timedelta(days=i))
-    
-    # Get schedule data for the week
-    week_schedule = {}
-    for date in week_dates:
-        date_str = date.strftime('%Y-%m-%d')
-        c.execute("SELECT * FROM schedule WHERE date = ?", (date_str,))
-        day_data = c.fetchone()
-        
-        week_schedule[date_str] = {
-            'date': date,
-            'day_name': date.strftime('%A'),
-            'day_short': date.strftime('%a'),
-            'day_number': date.day,
-            'month_name': date.strftime('%B'),
-            'data': day_data
-        }
-    
-    conn.close()
-    
-    return render_template('calendar.html', 
+
+    # Schedule data is near-static (only /import-calendar writes it), so the
+    # assembled week is memoized per Monday; importing invalidates the cache
+    cache_key = f"calendar:{target_monday.isoformat()}"
+    week_schedule = _cache_get(cache_key)
+
+    if week_schedule is None:
+        c = get_db().cursor()
+
+        # Create schedule table if it doesn't exist
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS schedule (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                date TEXT NOT NULL,
+                day_of_week TEXT,
+                day_number INTEGER,
+                event_type TEXT,
+                p1_course TEXT,
+                p2_course TEXT,
+                p3_course TEXT,
+                p4_course TEXT,
+                UNIQUE(date)
+            )
+        ''')
+
+        # Get schedule data for the whole week in one ranged query instead
+        # of one SELECT per day
+        c.execute(Q_SCHEDULE_WEEK,
+                  (week_dates[0].strftime('%Y-%m-%d'), week_dates[-1].strftime('%Y-%m-%d')))
+        days_by_date = {row['date']: row for row in c}
+
+        week_schedule = {}
+        for date in week_dates:
+            date_str = date.strftime('%Y-%m-%d')
+            day_data = days_by_date.get(date_str)
+
+            week_schedule[date_str] = {
+                'date': date,
+                'day_name': date.strftime('%A'),
+                'day_short': date.strftime('%a'),
+                'day_number': date.day,
+                'month_name': date.strftime('%B'),
+                'data': day_data
+            }
+
+        _cache_set(cache_key, week_schedule)
+
+    return render_template('calendar.html',
                          week_schedule=week_schedule,
                          week_dates=week_dates,
                          current_week_offset=week_offset,
@@ -534,7 +1140,7 @@ def import_calendar():
         flash("Fichier CSV non trouvé", 'error')
         return redirect(url_for('calendar'))
     
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     c = conn.cursor()
     
     # Clear existing schedule data
@@ -563,13 +1169,12 @@ def import_calendar():
                 imported_count += 1
         
         conn.commit()
+        _cache_invalidate('calendar:')
         flash(f"Calendrier importé avec succès! {imported_count} entrées ajoutées.", 'success')
         
     except Exception as e:
         conn.rollback()
         flash(f"Erreur lors de l'importation: {e}", 'error')
-    finally:
-        conn.close()
     
     return redirect(url_for('calendar'))
 
@@ -578,52 +1183,33 @@ def lesson_detail(lesson_id):
     if 'user' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT * FROM lessons WHERE id=?", (lesson_id,))
-    lesson = c.fetchone()
-    
-    # Get user progress for this lesson
-    progress = None
-    if 'user_id' in session:
-        c.execute("SELECT * FROM student_progress WHERE user_id=? AND lesson_id=?", 
-                  (session['user_id'], lesson_id))
-        progress = c.fetchone()
-    
-    conn.close()
-    
-    if not lesson:
+    c = get_db().cursor()
+    # One LEFT JOIN fetches lesson and the user's progress row together;
+    # a NULL user_id simply matches no progress
+    c.execute(Q_LESSON_WITH_PROGRESS, (session.get('user_id'), lesson_id))
+    row = c.fetchone()
+
+    if not row:
         flash("Leçon non trouvée", 'error')
         return redirect(url_for('calendar'))
-    
-    return render_template('lesson_detail.html', lesson=lesson, progress=progress)
+
+    # sqlite3.Row gives the template name access to both halves; the
+    # progress columns are aliased so they never collide with lesson names
+    progress = row if row['progress_id'] is not None else None
+
+    return render_template('lesson_detail.html', lesson=row, progress=progress,
+                           content_sections=_parsed_lesson_content(lesson_id))
 
 @app.route('/mark_complete/<int:lesson_id>', methods=['POST'])
 def mark_complete(lesson_id):
     if 'user' not in session or 'user_id' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    # Check if progress entry exists
-    c.execute("SELECT id FROM student_progress WHERE user_id=? AND lesson_id=?", 
-              (session['user_id'], lesson_id))
-    existing = c.fetchone()
-    
-    if existing:
-        c.execute("""UPDATE student_progress 
-                     SET completed=?, completion_date=CURRENT_TIMESTAMP 
-                     WHERE user_id=? AND lesson_id=?""", 
-                  (True, session['user_id'], lesson_id))
-    else:
-        c.execute("""INSERT INTO student_progress (user_id, lesson_id, completed, completion_date)
-                     VALUES (?, ?, ?, CURRENT_TIMESTAMP)""", 
-                  (session['user_id'], lesson_id, True))
-    
-    conn.commit()
-    conn.close()
-    
+    # Single atomic upsert against the unique (user_id, lesson_id) index:
+    # no select-then-write round trip and no race window between them
+    with _write_tx(get_db()) as c:
+        c.execute(Q_PROGRESS_UPSERT, (session['user_id'], lesson_id))
+
     flash("Leçon marquée comme terminée!", 'success')
     return redirect(url_for('lesson_detail', lesson_id=lesson_id))
 
@@ -632,13 +1218,10 @@ def reading_log():
     if 'user' not in session or 'user_id' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT * FROM reading_log WHERE user_id=? ORDER BY reading_date DESC", 
-              (session['user_id'],))
+    c = get_db().cursor()
+    c.execute(Q_READING_LOG_BY_USER, (session['user_id'],))
     books = c.fetchall()
-    conn.close()
-    
+
     return render_template('reading_log.html', books=books)
 
 @app.route('/add_book', methods=['GET', 'POST'])
@@ -647,30 +1230,70 @@ def add_book():
         return redirect(url_for('login'))
     
     if request.method == 'POST':
+        form = request.form
         book_data = (
             session['user_id'],
-            request.form['title'],
-            request.form['author'],
-            request.form.get('pages_read', 0),
-            request.form.get('total_pages'),
-            request.form['reading_date'],
-            request.form.get('notes', ''),
-            request.form.get('rating') if request.form.get('rating') else None
+            form['title'],
+            form['author'],
+            form.get('pages_read', 0),
+            form.get('total_pages'),
+            form['reading_date'],
+            form.get('notes', ''),
+            form.get('rating') or None
         )
         
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("""INSERT INTO reading_log 
-                     (user_id, book_title, author, pages_read, total_pages, reading_date, notes, rating)
-                     VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", book_data)
-        conn.commit()
-        conn.close()
-        
+        with _write_tx(get_db()) as c:
+            c.execute("""INSERT INTO reading_log
+                         (user_id, book_title, author, pages_read, total_pages, reading_date, notes, rating)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", book_data)
+
         flash("Livre ajouté au carnet de lecture!", 'success')
         return redirect(url_for('reading_log'))
-    
+
     return render_template('add_book.html')
 
+@app.route('/add_books', methods=['POST'])
+def add_books():
+    """Bulk-add books to the reading log from a JSON list in one transaction"""
+    if 'user' not in session or 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Not logged in'}), 401
+
+    books = request.get_json(silent=True)
+    if not isinstance(books, list) or not books:
+        return jsonify({'success': False, 'error': 'Expected a non-empty JSON list of books'}), 400
+
+    rows = []
+    for book in books:
+        if not isinstance(book, dict) or not book.get('title'):
+            return jsonify({'success': False, 'error': 'Each book needs at least a title'}), 400
+        rows.append((
+            session['user_id'],
+            book['title'],
+            book.get('author'),
+            book.get('pages_read', 0),
+            book.get('total_pages'),
+            book.get('reading_date'),
+            book.get('notes', ''),
+            book.get('rating') or None
+        ))
+
+    conn = get_db()
+    c = conn.cursor()
+    try:
+        # Single transaction, chunked to stay well under SQLite's bound
+        # parameter limit no matter how long the reading list is
+        c.execute("BEGIN")
+        for i in range(0, len(rows), 400):
+            c.executemany("""INSERT INTO reading_log
+                             (user_id, book_title, author, pages_read, total_pages, reading_date, notes, rating)
+                             VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", rows[i:i + 400])
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+    return jsonify({'success': True, 'imported': len(rows)})
+
 @app.route('/dashboard')
 def dashboard():
     """Redirect to discipline-specific dashboard"""
@@ -681,6 +1304,42 @@ def dashboard():
     discipline = session.get('discipline', 'francais')
     return redirect(url_for('discipline_dashboard', discipline=discipline))
 
+# Static per-discipline presentation config; pure constant, built
+# once at import instead of per dashboard render
+DISCIPLINE_CONFIG = {
+    'mathematiques': {
+        'title': 'Mathématiques',
+        'icon': '🔢',
+        'theme': 'math',
+        'description': 'Algèbre, géométrie, statistiques et résolution de problèmes'
+    },
+    'francais': {
+        'title': 'Français',
+        'icon': '📖',
+        'theme': 'francais',
+        'description': 'Lecture, écriture, grammaire et littérature québécoise'
+    },
+    'histoire': {
+        'title': 'Histoire',
+        'icon': '🏛️',
+        'theme': 'histoire',
+        'description': 'Histoire du Québec, du Canada et civilisations anciennes'
+    },
+    'culture_citoyennete': {
+        'title': 'Culture et citoyenneté',
+        'icon': '🏳️',
+        'theme': 'culture',
+        'description': 'Éthique, culture québécoise et éducation à la citoyenneté'
+    },
+    'geographie': {
+        'title': 'Géographie',
+        'icon': '🌍',
+        'theme': 'geographie',
+        'description': 'Géographie du Québec, environnement et territoires'
+    }
+}
+
+
 @app.route('/dashboard/<discipline>')
 def discipline_dashboard(discipline):
     """Discipline-specific dashboard"""
@@ -688,14 +1347,12 @@ def discipline_dashboard(discipline):
         return redirect(url_for('login'))
     
     # Validate discipline
-    valid_disciplines = ['mathematiques', 'francais', 'histoire', 'culture_citoyennete', 'geographie']
-    if discipline not in valid_disciplines:
+    if discipline not in DISCIPLINE_CONFIG:
         flash("Discipline non reconnue", 'error')
         return redirect(url_for('discipline_selection'))
-    
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
+
+    c = get_db().cursor()
+
     # Get discipline-specific statistics
     user_id = session.get('user_id')
     completed_lessons = 0
@@ -704,36 +1361,31 @@ def discipline_dashboard(discipline):
     avg_rating = 0
     
     if user_id:
-        # Get completed lessons count for this discipline
+        # Fetch all four statistics in one round-trip through scalar
+        # subqueries instead of four separate statement dispatches
         if discipline == 'mathematiques':
-            c.execute("""SELECT COUNT(*) FROM student_progress sp 
-                        JOIN lessons l ON sp.lesson_id = l.id 
-                        WHERE sp.user_id=? AND sp.completed=1 AND l.subject='mathématiques'""", 
+            c.execute("""SELECT
+                            (SELECT COUNT(*) FROM student_progress sp
+                             JOIN lessons l ON sp.lesson_id = l.id
+                             WHERE sp.user_id=?1 AND sp.completed=1 AND l.subject='mathématiques'),
+                            (SELECT COUNT(*) FROM lessons WHERE subject='mathématiques'),
+                            COALESCE((SELECT books_read FROM user_stats WHERE user_id=?1), 0),
+                            (SELECT CASE WHEN n_rating > 0 THEN sum_rating / n_rating END
+                             FROM user_stats WHERE user_id=?1)""",
                      (user_id,))
-            completed_lessons = c.fetchone()[0]
-            
-            # Get total lessons for mathematics
-            c.execute("SELECT COUNT(*) FROM lessons WHERE subject='mathématiques'")
-            total_lessons = c.fetchone()[0]
         else:
             # For other disciplines, use general lesson count (adjust as needed)
-            c.execute("""SELECT COUNT(*) FROM student_progress sp 
-                        JOIN lessons l ON sp.lesson_id = l.id 
-                        WHERE sp.user_id=? AND sp.completed=1 AND (l.subject=? OR l.subject='français')""", 
+            c.execute("""SELECT
+                            (SELECT COUNT(*) FROM student_progress sp
+                             JOIN lessons l ON sp.lesson_id = l.id
+                             WHERE sp.user_id=?1 AND sp.completed=1 AND (l.subject=?2 OR l.subject='français')),
+                            (SELECT COUNT(*) FROM lessons WHERE subject=?2 OR subject='français'),
+                            COALESCE((SELECT books_read FROM user_stats WHERE user_id=?1), 0),
+                            (SELECT CASE WHEN n_rating > 0 THEN sum_rating / n_rating END
+                             FROM user_stats WHERE user_id=?1)""",
                      (user_id, discipline))
-            completed_lessons = c.fetchone()[0]
-            
-            # Get total lessons count
-            c.execute("SELECT COUNT(*) FROM lessons WHERE subject=? OR subject='français'", (discipline,))
-            total_lessons = c.fetchone()[0]
-        
-        # Get books read count (common for all disciplines)
-        c.execute("SELECT COUNT(*) FROM reading_log WHERE user_id=?", (user_id,))
-        books_read = c.fetchone()[0]
-        
-        # Get average rating
-        c.execute("SELECT AVG(rating) FROM reading_log WHERE user_id=? AND rating IS NOT NULL", (user_id,))
-        avg_rating_result = c.fetchone()[0]
+
+        completed_lessons, total_lessons, books_read, avg_rating_result = c.fetchone()
         avg_rating = round(avg_rating_result, 1) if avg_rating_result else 0
     
     # Calculate progress percentage
@@ -790,47 +1442,12 @@ def discipline_dashboard(discipline):
             {'code': 'C2', 'title': 'Interpréter un enjeu territorial', 'description': 'Analyser un enjeu territorial en considérant les multiples perspectives des acteurs concernés et en établissant des liens entre les dimensions du développement durable.', 'progress': 42},
             {'code': 'C3', 'title': 'Construire sa conscience citoyenne à l\'échelle planétaire', 'description': 'Développer sa capacité d\'action citoyenne responsable en s\'appuyant sur la compréhension des enjeux territoriaux locaux et mondiaux.', 'progress': 38}
         ]
-    
-    conn.close()
-    
-    # Discipline configuration
-    discipline_config = {
-        'mathematiques': {
-            'title': 'Mathématiques',
-            'icon': '🔢',
-            'theme': 'math',
-            'description': 'Algèbre, géométrie, statistiques et résolution de problèmes'
-        },
-        'francais': {
-            'title': 'Français',
-            'icon': '📖',
-            'theme': 'francais',
-            'description': 'Lecture, écriture, grammaire et littérature québécoise'
-        },
-        'histoire': {
-            'title': 'Histoire',
-            'icon': '🏛️',
-            'theme': 'histoire',
-            'description': 'Histoire du Québec, du Canada et civilisations anciennes'
-        },
-        'culture_citoyennete': {
-            'title': 'Culture et citoyenneté',
-            'icon': '🏳️',
-            'theme': 'culture',
-            'description': 'Éthique, culture québécoise et éducation à la citoyenneté'
-        },
-        'geographie': {
-            'title': 'Géographie',
-            'icon': '🌍',
-            'theme': 'geographie',
-            'description': 'Géographie du Québec, environnement et territoires'
-        }
-    }
+
     
     # Prepare data for template
     data = {
         'discipline': discipline,
-        'discipline_config': discipline_config[discipline],
+        'discipline_config': DISCIPLINE_CONFIG[discipline],
         'completed_lessons': completed_lessons,
         'total_lessons': total_lessons,
         'books_read': books_read,
@@ -838,7 +1455,7 @@ def discipline_dashboard(discipline):
         'progress_percentage': progress_percentage,
         'recent_activity': recent_activity,
         'competencies': competencies,
-        'available_disciplines': valid_disciplines
+        'available_disciplines': list(DISCIPLINE_CONFIG)
     }
     
     return render_template('discipline_dashboard.html', **data)
@@ -853,36 +1470,36 @@ def lessons_list():
     search_query = request.args.get('search', '')
     subject_filter = request.args.get('subject', session.get('discipline', 'français'))
     
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     c = conn.cursor()
     
-    # Build query with filters - always filter by subject first
-    query = "SELECT * FROM lessons WHERE subject = ?"
-    params = [subject_filter]
-    
-    if month_filter:
-        query += " AND month = ?"
-        params.append(month_filter)
-    
-    
-    if search_query:
-        query += " AND (title LIKE ? OR content LIKE ?)"
-        params.extend([f"%{search_query}%", f"%{search_query}%"])
-    
-    query += " ORDER BY subject, title"
-    
-    c.execute(query, params)
-    lessons = c.fetchall()
-    
-    # Get unique months for filters - filtered by subject
-    c.execute("SELECT DISTINCT month FROM lessons WHERE subject = ? ORDER BY id", (subject_filter,))
-    months = [row[0] for row in c.fetchall()]
+    # The post-bulk-action pattern is submit -> redirect -> re-list, so the
+    # filtered rows are cached under the lessons write version: any lesson
+    # write bumps the version and the next GET rebuilds once
+    cache_key = (f"lessons:{_lessons_version}:list:"
+                 f"{subject_filter}:{month_filter}:{search_query}")
+    lessons = _cache_get(cache_key)
+    if lessons is None:
+        # Indexed full-text search when the query is long enough for FTS,
+        # otherwise the fixed-shape filter statement (with LIKE fallback
+        # for short search strings)
+        match = _fts_match_query(search_query) if search_query else None
+        if match:
+            c.execute(Q_LESSONS_SEARCH, {'subject': subject_filter,
+                                         'match': match,
+                                         'month': month_filter})
+        else:
+            c.execute(Q_LESSONS_LIST, {'subject': subject_filter,
+                                       'month': month_filter,
+                                       'q': search_query,
+                                       'q_like': f"%{search_query}%"})
+        lessons = c.fetchall()
+        _cache_set(cache_key, lessons, timeout=60)
     
-    # Get available subjects for filter dropdown
-    c.execute("SELECT DISTINCT subject FROM lessons WHERE subject IS NOT NULL ORDER BY subject")
-    available_subjects = [row[0] for row in c.fetchall()]
+    # Filter dropdowns come from the version-keyed cache
+    months = _distinct_months(subject_filter)
+    available_subjects = _available_subjects()
     
-    conn.close()
     
     return render_template('lessons_list.html', 
                          lessons=lessons, 
@@ -901,39 +1518,44 @@ def create_lesson():
         return redirect(url_for('login'))
     
     if request.method == 'POST':
-        subject = request.form.get('subject', 'français')
+        form = request.form
         
-        conn = sqlite3.connect(DB_FILE)
+        conn = get_db()
         c = conn.cursor()
         
         lesson_data = {
-            'month': request.form['month'],
-            'week_number': request.form.get('week_number', type=int),
-            'day_number': request.form.get('day_number', type=int),
-            'title': request.form['title'],
-            'content': request.form['content'],
-            'duration': request.form.get('duration', 75, type=int),
-            'materials': request.form.get('materials', ''),
-            'objectives': request.form.get('objectives', ''),
-            'tags': request.form.get('tags', ''),
-            'subject': subject,
-            'lesson_date': request.form.get('lesson_date', ''),
-            'period': request.form.get('period', '')
+            'month': form['month'],
+            'week_number': form.get('week_number', type=int),
+            'day_number': form.get('day_number', type=int),
+            'title': form['title'],
+            'content': form['content'],
+            'duration': form.get('duration', 75, type=int),
+            'materials': form.get('materials', ''),
+            'objectives': form.get('objectives', ''),
+            'tags': form.get('tags', ''),
+            'subject': form.get('subject', 'français'),
+            'lesson_date': form.get('lesson_date', ''),
+            'period': form.get('period', '')
         }
         
         try:
+            # Named parameters: the dict binds directly, no tuple copy and
+            # no dependence on dict insertion order
             c.execute('''
                 INSERT INTO lessons 
                 (month, week_number, day_number, title, content, 
                  duration, materials, objectives, tags, subject, lesson_date, period)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', tuple(lesson_data.values()))
+                VALUES (:month, :week_number, :day_number, :title, :content,
+                        :duration, :materials, :objectives, :tags, :subject,
+                        :lesson_date, :period)
+            ''', lesson_data)
             
             conn.commit()
+            _bump_lessons_version()
             flash(f"Leçon '{lesson_data['title']}' créée avec succès!", 'success')
             
             # If came from calendar, redirect back to calendar
-            if request.form.get('lesson_date') and request.args.get('date'):
+            if form.get('lesson_date') and request.args.get('date'):
                 return redirect(url_for('calendar'))
             else:
                 return redirect(url_for('lessons_list'))
@@ -942,14 +1564,9 @@ def create_lesson():
             flash("Erreur: Une leçon avec ce numéro existe déjà", 'error')
         except Exception as e:
             flash(f"Erreur lors de la création: {e}", 'error')
-        finally:
-            conn.close()
     
-    # Get available subjects for the dropdown
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT DISTINCT subject FROM lessons WHERE subject IS NOT NULL ORDER BY subject")
-    available_subjects = [row[0] for row in c.fetchall()]
+    # Get available subjects for the dropdown (cached)
+    available_subjects = _available_subjects()
     
     # Add the 5 main subjects if they don't exist yet
     all_subjects = ['français', 'mathématiques', 'histoire', 'geographie', 'culture_citoyennete']
@@ -957,7 +1574,6 @@ def create_lesson():
         if subject not in available_subjects:
             available_subjects.append(subject)
     
-    conn.close()
     
     # Handle URL parameters from calendar clicks
     calendar_data = {}
@@ -995,35 +1611,38 @@ def edit_lesson(lesson_id):
     if 'user' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     c = conn.cursor()
     
     if request.method == 'POST':
         try:
+            form = request.form
             c.execute('''
                 UPDATE lessons SET 
                 month=?, week_number=?, day_number=?, title=?, 
-                content=?, duration=?, materials=?, objectives=?, 
+                content=?, content_json=NULL, duration=?, materials=?, objectives=?,
                 subject=?, evaluation=?, homework=?, adaptations=?, notes=?, updated_at=CURRENT_TIMESTAMP
                 WHERE id=?
             ''', (
-                request.form['month'],
-                request.form.get('week', type=int),
-                request.form.get('day', type=int),
-                request.form['title'],
-                request.form['content'],
-                request.form.get('duration', 75, type=int),
-                request.form.get('materials', ''),
-                request.form.get('objectives', ''),
-                request.form.get('subject', ''),
-                request.form.get('evaluation', ''),
-                request.form.get('homework', ''),
-                request.form.get('adaptations', ''),
-                request.form.get('notes', ''),
+                form['month'],
+                form.get('week', type=int),
+                form.get('day', type=int),
+                form['title'],
+                form['content'],
+                form.get('duration', 75, type=int),
+                form.get('materials', ''),
+                form.get('objectives', ''),
+                form.get('subject', ''),
+                form.get('evaluation', ''),
+                form.get('homework', ''),
+                form.get('adaptations', ''),
+                form.get('notes', ''),
                 lesson_id
             ))
             
             conn.commit()
+            _bump_lessons_version()
+            _parsed_lesson_content.cache_clear()
             flash("Leçon mise à jour avec succès!", 'success')
             return redirect(url_for('lesson_detail', lesson_id=lesson_id))
             
@@ -1034,11 +1653,9 @@ def edit_lesson(lesson_id):
     c.execute("SELECT * FROM lessons WHERE id=?", (lesson_id,))
     lesson = c.fetchone()
     
-    # Get available subjects for dropdown
-    c.execute("SELECT DISTINCT subject FROM lessons WHERE subject IS NOT NULL ORDER BY subject")
-    available_subjects = [row[0] for row in c.fetchall()]
+    # Get available subjects for dropdown (cached)
+    available_subjects = _available_subjects()
     
-    conn.close()
     
     if not lesson:
         flash("Leçon non trouvée", 'error')
@@ -1062,7 +1679,7 @@ def lesson_for_slot():
     
     try:
         # Search for existing lesson by date
-        conn = sqlite3.connect(DB_FILE)
+        conn = get_db()
         c = conn.cursor()
         
         # Look for lesson matching exact date and subject/course
@@ -1074,7 +1691,6 @@ def lesson_for_slot():
         """, (date_str, f'%{course.lower()}%', f'%{course}%'))
         
         result = c.fetchone()
-        conn.close()
         
         if result:
             return {'lesson_id': result[0]}
@@ -1090,51 +1706,38 @@ def duplicate_lesson(lesson_id):
     if 'user' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     c = conn.cursor()
-    
-    # Get original lesson
-    c.execute("SELECT * FROM lessons WHERE id=?", (lesson_id,))
-    original = c.fetchone()
-    
-    if not original:
-        flash("Leçon non trouvée", 'error')
-        return redirect(url_for('lessons_list'))
-    
-    subject = original[11] if len(original) > 11 else 'français'  # Get subject from original lesson
-    
+
     try:
-        # Create duplicate
+        # Copy entirely inside the engine: the original row never crosses
+        # into Python
         c.execute('''
-            INSERT INTO lessons 
-            (month, week_number, day_number, title, content, 
+            INSERT INTO lessons
+            (month, week_number, day_number, title, content,
              duration, materials, objectives, tags, subject, lesson_date, period)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            original[1],  # month
-            original[2],  # week_number
-            original[3],  # day_number
-            f"[COPIE] {original[4]}",  # title
-            original[5],  # content
-            original[6],  # duration
-            original[8],  # materials
-            original[9], # objectives
-            original[10], # tags
-            subject,  # subject
-            original[12] if len(original) > 12 else '',  # lesson_date
-            original[13] if len(original) > 13 else ''   # period
-        ))
-        
+            SELECT month, week_number, day_number, '[COPIE] ' || title, content,
+                   duration, materials, objectives, tags,
+                   COALESCE(subject, 'français'),
+                   COALESCE(lesson_date, ''), COALESCE(period, '')
+            FROM lessons WHERE id = ?
+            RETURNING id
+        ''', (lesson_id,))
+
+        row = c.fetchone()
+        if row is None:
+            flash("Leçon non trouvée", 'error')
+            return redirect(url_for('lessons_list'))
+
         conn.commit()
-        new_lesson_id = c.lastrowid
+        _bump_lessons_version()
+        new_lesson_id = row[0]
         flash("Leçon dupliquée avec succès!", 'success')
         return redirect(url_for('edit_lesson', lesson_id=new_lesson_id))
-        
+
     except Exception as e:
         flash(f"Erreur lors de la duplication: {e}", 'error')
         return redirect(url_for('lesson_detail', lesson_id=lesson_id))
-    finally:
-        conn.close()
 
 @app.route('/lesson/<int:lesson_id>/delete', methods=['POST'])
 def delete_lesson(lesson_id):
@@ -1142,7 +1745,7 @@ def delete_lesson(lesson_id):
     if 'user' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     c = conn.cursor()
     
     try:
@@ -1154,19 +1757,15 @@ def delete_lesson(lesson_id):
             flash("Leçon non trouvée", 'error')
             return redirect(url_for('lessons_list'))
         
-        # Delete the lesson
+        # Delete the lesson; progress rows follow via ON DELETE CASCADE
         c.execute("DELETE FROM lessons WHERE id=?", (lesson_id,))
-        
-        # Delete related progress entries
-        c.execute("DELETE FROM student_progress WHERE lesson_id=?", (lesson_id,))
-        
+
         conn.commit()
+        _bump_lessons_version()
         flash(f"Leçon '{lesson[0]}' supprimée avec succès", 'success')
         
     except Exception as e:
         flash(f"Erreur lors de la suppression: {e}", 'error')
-    finally:
-        conn.close()
     
     return redirect(url_for('lessons_list'))
 
@@ -1190,40 +1789,60 @@ def import_lessons():
             if file.filename.endswith('.csv'):
                 # Read CSV content
                 stream = io.StringIO(file.stream.read().decode("UTF8"), newline=None)
-                csv_input = csv.DictReader(stream)
-                
-                lessons_imported = 0
-                conn = sqlite3.connect(DB_FILE)
+                csv_input = csv.reader(stream)
+
+                # Resolve column positions once from the header, then read
+                # each row by integer index: no per-row dict construction or
+                # hash lookups like DictReader does.  Missing or short rows
+                # fall back to '' and get their defaults in SQL below.
+                header = next(csv_input, None) or []
+                positions = [header.index(name) if name in header else -1
+                             for name in ('month', 'week_number', 'day_number',
+                                          'title', 'content', 'duration',
+                                          'materials', 'objectives', 'tags',
+                                          'subject')]
+
+                # Stage the raw text rows into a temp table with chunked
+                # executemany, then let one INSERT ... SELECT do the numeric
+                # coercion and defaulting in SQLite instead of per-row
+                # int() dispatch in Python
+                rows = [tuple(row[i] if 0 <= i < len(row) else ''
+                              for i in positions)
+                        for row in csv_input]
+
+                conn = get_db()
                 c = conn.cursor()
-                
-                for row in csv_input:
-                    try:
-                        c.execute('''
-                            INSERT INTO lessons 
-                            (month, week_number, day_number, title, content, 
-                             duration, materials, objectives, tags, subject)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        ''', (
-                            row.get('month', ''),
-                            int(row.get('week_number', 1)),
-                            int(row.get('day_number', 1)),
-                            row.get('title', ''),
-                            row.get('content', ''),
-                            int(row.get('duration', 75)),
-                            row.get('materials', ''),
-                            row.get('objectives', ''),
-                            row.get('tags', ''),
-                            row.get('subject', 'français')
-                        ))
-                        lessons_imported += 1
-                    except Exception as e:
-                        print(f"Error importing row: {e}")
-                        continue
-                
+                c.execute("BEGIN")
+                c.execute('''
+                    CREATE TEMP TABLE tmp_lesson_import (
+                        month TEXT, week_number TEXT, day_number TEXT,
+                        title TEXT, content TEXT, duration TEXT,
+                        materials TEXT, objectives TEXT, tags TEXT, subject TEXT
+                    )
+                ''')
+                for i in range(0, len(rows), 10000):
+                    c.executemany(
+                        "INSERT INTO tmp_lesson_import VALUES (?,?,?,?,?,?,?,?,?,?)",
+                        rows[i:i + 10000])
+                c.execute('''
+                    INSERT INTO lessons
+                        (month, week_number, day_number, title, content,
+                         duration, materials, objectives, tags, subject)
+                    SELECT month,
+                           CAST(COALESCE(NULLIF(week_number, ''), '1') AS INTEGER),
+                           CAST(COALESCE(NULLIF(day_number, ''), '1') AS INTEGER),
+                           title, content,
+                           CAST(COALESCE(NULLIF(duration, ''), '75') AS INTEGER),
+                           materials, objectives, tags,
+                           COALESCE(NULLIF(subject, ''), 'français')
+                    FROM tmp_lesson_import
+                ''')
+                imported = c.rowcount
+                c.execute("DROP TABLE tmp_lesson_import")
                 conn.commit()
-                conn.close()
-                
-                flash(f"{lessons_imported} leçons importées avec succès!", 'success')
+                _bump_lessons_version()
+
+                flash(f"{imported} leçons importées avec succès!", 'success')
                 return redirect(url_for('lessons_list'))
             
             else:
@@ -1240,30 +1859,12 @@ def export_lessons():
     if 'user' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
+    c = get_db().cursor()
     c.execute("SELECT * FROM lessons ORDER BY id")
-    lessons = c.fetchall()
-    conn.close()
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Write header
-    writer.writerow([
-        'id', 'month', 'week_number', 'day_number', 
-        'title', 'content', 'duration', 'materials', 
-        'objectives', 'tags', 'created_at', 'updated_at'
-    ])
-    
-    # Write lesson data
-    for lesson in lessons:
-        writer.writerow(lesson)
-    
-    output.seek(0)
-    
+    header = [col[0] for col in c.description]
+
     return Response(
-        output.getvalue(),
+        stream_with_context(_stream_csv(c, header)),
         mimetype='text/csv',
         headers={'Content-Disposition': f'attachment; filename=lessons_export_{datetime.now().strftime("%Y%m%d")}.csv'}
     )
@@ -1273,41 +1874,67 @@ def bulk_actions():
     """Handle bulk actions on lessons"""
     if 'user' not in session:
         return redirect(url_for('login'))
-    
+
+    # fetch()/XHR callers get JSON and patch their own DOM; the plain form
+    # path keeps the flash + PRG redirect, which re-renders the list
+    wants_json = request.headers.get('X-Requested-With') in ('fetch', 'XMLHttpRequest')
+
+    def fail(message, status=400):
+        if wants_json:
+            return jsonify(ok=False, error=message), status
+        flash(message, 'error')
+        return redirect(_lessons_list_url())
+
     action = request.form.get('action')
-    lesson_ids = request.form.getlist('lesson_ids')
+    # type=int lets Werkzeug retrieve and coerce in one pass over the
+    # parsed form; non-numeric entries are dropped rather than binding
+    # TEXT against the INTEGER primary key
+    lesson_ids = request.form.getlist('lesson_ids', type=int)
     
     if not lesson_ids:
-        flash('Aucune leçon sélectionnée', 'error')
-        return redirect(url_for('lessons_list'))
-    
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
+        return fail('Aucune leçon sélectionnée')
+
+    spec = BULK_ACTIONS.get(action)
+    if spec is None:
+        return fail('Action inconnue')
+
+    value = request.form.get(spec['value_field']) if spec['value_field'] else None
+    if spec['value_field'] and not value:
+        return fail('Valeur manquante pour cette action')
+
+    # Very large selections would hold the request (and its WSGI thread)
+    # for the whole commit; hand them to a background thread and answer now
+    if len(lesson_ids) >= BULK_ASYNC_THRESHOLD:
+        threading.Thread(target=_bulk_action_worker,
+                         args=(spec, lesson_ids, value, action),
+                         daemon=True).start()
+        if wants_json:
+            return jsonify(ok=True, queued=len(lesson_ids)), 202
+        flash(f"Action lancée en arrière-plan pour {len(lesson_ids)} leçons",
+              'success')
+        return redirect(_lessons_list_url())
+
+    conn = get_db()
     try:
-        if action == 'delete':
-            placeholders = ','.join(['?' for _ in lesson_ids])
-            c.execute(f"DELETE FROM lessons WHERE id IN ({placeholders})", lesson_ids)
-            c.execute(f"DELETE FROM student_progress WHERE lesson_id IN ({placeholders})", lesson_ids)
-            flash(f"{len(lesson_ids)} leçons supprimées", 'success')
-            
-        elif action == 'update_month':
-            new_month = request.form.get('new_month')
-            if new_month:
-                placeholders = ','.join(['?' for _ in lesson_ids])
-                c.execute(f"UPDATE lessons SET month=? WHERE id IN ({placeholders})", 
-                         [new_month] + lesson_ids)
-                flash(f"{len(lesson_ids)} leçons mises à jour (mois: {new_month})", 'success')
-            
-        
-        conn.commit()
-        
-    except Exception as e:
-        flash(f"Erreur lors de l'action groupée: {e}", 'error')
-    finally:
-        conn.close()
+        # One BEGIN IMMEDIATE transaction; executemany keeps the SQL text
+        # constant regardless of how many ids were selected, so the
+        # prepared statement is reused instead of re-parsed per batch
+        # size. The returned rowcount counts lessons rows, so the flash
+        # reports what actually changed, not what was selected.
+        affected = _execute_bulk(conn, spec, lesson_ids, value)
+        if wants_json:
+            return jsonify(ok=True, affected=affected)
+        flash(spec['message'].format(n=affected, value=value), 'success')
+
+    except sqlite3.DatabaseError:
+        conn.rollback()
+        # Full traceback to the log; the user gets a generic message rather
+        # than internal error detail
+        logger.exception("Bulk action %r failed for %d lessons",
+                         action, len(lesson_ids))
+        return fail("Erreur lors de l'action groupée", status=500)
     
-    return redirect(url_for('lessons_list'))
+    return redirect(_lessons_list_url())
 
 # Math Schedule Routes
 # Math import route moved to math_schedule_importer.py to avoid duplication
@@ -1316,7 +1943,7 @@ def bulk_actions():
 def math_schedule_overview():
     """Display overview of the mathematics curriculum"""
     try:
-        conn = sqlite3.connect(DB_FILE)
+        conn = get_db()
         cursor = conn.cursor()
         
         # Get lessons by cycle with tags
@@ -1340,15 +1967,15 @@ def math_schedule_overview():
         ''')
         competencies = cursor.fetchall()
         
-        # Get total statistics
-        cursor.execute('SELECT COUNT(*) FROM lessons WHERE subject = "mathématiques"')
-        total_lessons = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(DISTINCT week_number) FROM lessons WHERE subject = "mathématiques"')
-        total_cycles = cursor.fetchone()[0]
-        
-        conn.close()
-        
+        # Get total statistics in one scan instead of two COUNT probes
+        cursor.execute('''
+            SELECT COUNT(*), COUNT(DISTINCT week_number)
+            FROM lessons
+            WHERE subject = 'mathématiques'
+        ''')
+        total_lessons, total_cycles = cursor.fetchone()
+
+
         return render_template('math_schedule_overview.html', 
                              cycles=cycles, 
                              competencies=competencies,
@@ -1367,7 +1994,7 @@ def math_units():
 def competencies_overview():
     """Display overview of PFEQ competencies distribution"""
     try:
-        conn = sqlite3.connect(DB_FILE)
+        conn = get_db()
         cursor = conn.cursor()
         
         # Get competency distribution by cycle
@@ -1391,7 +2018,6 @@ def competencies_overview():
         
         overall_stats = cursor.fetchone()
         
-        conn.close()
         
         competencies_info = {
             'C1': {
@@ -1426,7 +2052,7 @@ def competencies_overview():
 def progress_dashboard():
     """Display student progress dashboard"""
     try:
-        conn = sqlite3.connect(DB_FILE)
+        conn = get_db()
         cursor = conn.cursor()
         
         user_id = session.get('user_id', 1)
@@ -1476,7 +2102,6 @@ def progress_dashboard():
         
         recent_activity = cursor.fetchall()
         
-        conn.close()
         
         return render_template('progress_dashboard.html',
                              overall_progress=overall_progress,
@@ -1492,7 +2117,7 @@ def theory():
     if 'user' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     c = conn.cursor()
     
     discipline = session.get('discipline', 'français')
@@ -1506,7 +2131,6 @@ def theory():
     ''', (discipline,))
     
     theory_items = c.fetchall()
-    conn.close()
     
     return render_template('theory.html', theory_items=theory_items, discipline=discipline)
 
@@ -1523,25 +2147,23 @@ def create_theory():
         exercise_type = request.form.get('exercise_type', '')
         discipline = session.get('discipline', 'français')
         
-        conn = sqlite3.connect(DB_FILE)
+        conn = get_db()
         c = conn.cursor()
         c.execute('''
             INSERT INTO theory (lesson_id, title, description, content, exercise_type, discipline)
             VALUES (?, ?, ?, ?, ?, ?)
         ''', (lesson_id, title, description, content, exercise_type, discipline))
         conn.commit()
-        conn.close()
         
         flash('Ressource théorique créée avec succès!', 'success')
         return redirect(url_for('theory'))
     
     # Get lessons for dropdown
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     c = conn.cursor()
     discipline = session.get('discipline', 'français')
     c.execute('SELECT id, title FROM lessons WHERE subject = ? ORDER BY id', (discipline,))
     lessons = c.fetchall()
-    conn.close()
     
     return render_template('create_theory.html', lessons=lessons)
 
@@ -1551,7 +2173,7 @@ def exercises():
     if 'user' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     c = conn.cursor()
     
     discipline = session.get('discipline', 'français')
@@ -1565,7 +2187,6 @@ def exercises():
     ''', (discipline,))
     
     exercises_list = c.fetchall()
-    conn.close()
     
     return render_template('exercises.html', exercises=exercises_list, discipline=discipline)
 
@@ -1585,27 +2206,25 @@ def create_exercise():
         points = int(request.form.get('points', 10))
         discipline = session.get('discipline', 'français')
         
-        conn = sqlite3.connect(DB_FILE)
+        conn = get_db()
         c = conn.cursor()
         c.execute('''
             INSERT INTO exercises (lesson_id, theory_id, title, description, exercise_type, content, answer_key, points, discipline)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (lesson_id, theory_id, title, description, exercise_type, content, answer_key, points, discipline))
         conn.commit()
-        conn.close()
         
         flash('Exercice créé avec succès!', 'success')
         return redirect(url_for('exercises'))
     
     # Get lessons and manuel items for dropdowns
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     c = conn.cursor()
     discipline = session.get('discipline', 'français')
     c.execute('SELECT id, title FROM lessons WHERE subject = ? ORDER BY id', (discipline,))
     lessons = c.fetchall()
     c.execute('SELECT id, title FROM theory WHERE discipline = ? ORDER BY title', (discipline,))
     theory_items = c.fetchall()
-    conn.close()
     
     return render_template('create_exercise.html', lessons=lessons, theory_items=theory_items)
 
@@ -1615,7 +2234,7 @@ def portfolio():
     if 'user' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     c = conn.cursor()
     
     discipline = session.get('discipline', 'français')
@@ -1630,7 +2249,6 @@ def portfolio():
     ''', (discipline, user_id))
     
     portfolio_items = c.fetchall()
-    conn.close()
     
     return render_template('portfolio.html', portfolio_items=portfolio_items, discipline=discipline)
 
@@ -1649,25 +2267,23 @@ def create_portfolio_item():
         discipline = session.get('discipline', 'français')
         user_id = session.get('user_id')
         
-        conn = sqlite3.connect(DB_FILE)
+        conn = get_db()
         c = conn.cursor()
         c.execute('''
             INSERT INTO portfolio_items (user_id, lesson_id, item_type, title, description, content, due_date, discipline)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         ''', (user_id, lesson_id, item_type, title, description, content, due_date, discipline))
         conn.commit()
-        conn.close()
         
         flash('Élément de portfolio créé avec succès!', 'success')
         return redirect(url_for('portfolio'))
     
     # Get lessons for dropdown
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     c = conn.cursor()
     discipline = session.get('discipline', 'français')
     c.execute('SELECT id, title FROM lessons WHERE subject = ? ORDER BY id', (discipline,))
     lessons = c.fetchall()
-    conn.close()
     
     return render_template('create_portfolio_item.html', lessons=lessons)
 
@@ -1678,7 +2294,7 @@ def grammar_gender_exercises():
     if 'user' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     c = conn.cursor()
     
     user_id = session.get('user_id')
@@ -1716,7 +2332,6 @@ def grammar_gender_exercises():
     ''')
     question_distribution = c.fetchall()
     
-    conn.close()
     
     return render_template('grammar_gender_dashboard.html', 
                          stats=stats, 
@@ -1732,7 +2347,7 @@ def start_grammar_gender_practice():
     questions_count = request.args.get('count', 10, type=int)
     difficulty = request.args.get('difficulty', 'all')
     
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     c = conn.cursor()
     
     # Create new session
@@ -1744,7 +2359,6 @@ def start_grammar_gender_practice():
     session_id = c.lastrowid
     
     conn.commit()
-    conn.close()
     
     return redirect(url_for('grammar_gender_question', session_id=session_id, question_num=1))
 
@@ -1754,7 +2368,7 @@ def grammar_gender_question(session_id, question_num):
     if 'user' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     c = conn.cursor()
     
     # Verify session belongs to user
@@ -1813,7 +2427,6 @@ def grammar_gender_question(session_id, question_num):
         answer_key.get('feedback', {}).get('general_rule', '')  # terminaisons/rule
     )
     
-    conn.close()
     
     progress = {
         'current': answered_count + 1,
@@ -1838,7 +2451,7 @@ def submit_grammar_gender_answer(session_id):
     time_taken = request.form.get('time_taken', 0, type=int)
     hints_used = request.form.get('hints_used', 0, type=int)
     
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     c = conn.cursor()
     
     # Check if this is a literature exercise (prefixed with L)
@@ -1949,7 +2562,6 @@ def submit_grammar_gender_answer(session_id):
         ''', (session_id,))
     
     conn.commit()
-    conn.close()
     
     return jsonify(response_data)
 
@@ -1959,7 +2571,7 @@ def grammar_gender_results(session_id):
     if 'user' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     c = conn.cursor()
     
     # Get session data
@@ -1983,7 +2595,6 @@ def grammar_gender_results(session_id):
     ''', (session_id,))
     attempts = c.fetchall()
     
-    conn.close()
     
     # Calculate statistics
     total_questions = len(attempts)
@@ -2019,7 +2630,7 @@ def conjugation_exercises():
     if 'user' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     c = conn.cursor()
     user_id = session.get('user_id')
     
@@ -2053,7 +2664,6 @@ def conjugation_exercises():
     ''', (user_id,))
     recent_attempts = c.fetchall()
     
-    conn.close()
     
     return render_template('conjugation_dashboard.html',
                          total_exercises=total_exercises,
@@ -2067,17 +2677,18 @@ def manage_grammar_gender_questions():
         flash('Accès non autorisé', 'error')
         return redirect(url_for('grammar_gender_exercises'))
     
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     c = conn.cursor()
     
     c.execute('''
-        SELECT * FROM grammar_gender_questions 
+        SELECT * FROM grammar_gender_questions
         ORDER BY niveau_difficulte, nom
     ''')
-    questions = c.fetchall()
-    
-    conn.close()
-    
+    # Plain tuples: the template feeds this list through |tojson, which
+    # cannot serialize sqlite3.Row objects
+    questions = [tuple(q) for q in c.fetchall()]
+
+
     return render_template('manage_grammar_questions.html', questions=questions)
 
 @app.route('/flag-question', methods=['POST'])
@@ -2094,7 +2705,7 @@ def flag_question():
     if not all([question_id, question_type, flag_reason]):
         return jsonify({'success': False, 'error': 'Missing required fields'})
     
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     c = conn.cursor()
     
     try:
@@ -2110,8 +2721,6 @@ def flag_question():
     except Exception as e:
         logger.error(f"Error flagging question: {e}")
         return jsonify({'success': False, 'error': 'Database error'})
-    finally:
-        conn.close()
 
 @app.route('/exercises/grammar/gender/add-question', methods=['GET', 'POST'])
 def add_grammar_gender_question():
@@ -2121,7 +2730,7 @@ def add_grammar_gender_question():
         return redirect(url_for('grammar_gender_exercises'))
     
     if request.method == 'POST':
-        conn = sqlite3.connect(DB_FILE)
+        conn = get_db()
         c = conn.cursor()
         
         try:
@@ -2148,8 +2757,6 @@ def add_grammar_gender_question():
             flash('ID de question déjà existant', 'error')
         except Exception as e:
             flash(f'Erreur: {e}', 'error')
-        finally:
-            conn.close()
     
     return render_template('add_grammar_question.html')
 
@@ -2165,7 +2772,7 @@ def math_exercises(subdiscipline):
         flash('Sous-discipline non valide', 'error')
         return redirect(url_for('exercises'))
     
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     c = conn.cursor()
     
     # Get exercises for mathematics with specific subdiscipline (stored in exercise_type or tags)
@@ -2177,7 +2784,6 @@ def math_exercises(subdiscipline):
     ''', (f'%{subdiscipline}%', f'%{subdiscipline}%'))
     
     exercises_list = c.fetchall()
-    conn.close()
     
     subdiscipline_names = {
         'algebre': 'Algèbre',
@@ -2203,7 +2809,7 @@ def french_exercises(subdiscipline):
         flash('Sous-discipline non valide', 'error')
         return redirect(url_for('exercises'))
     
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     c = conn.cursor()
     
     c.execute('''
@@ -2214,7 +2820,6 @@ def french_exercises(subdiscipline):
     ''', (f'%{subdiscipline}%', f'%{subdiscipline}%'))
     
     exercises_list = c.fetchall()
-    conn.close()
     
     subdiscipline_names = {
         'orthographe': 'Orthographe',
@@ -2239,7 +2844,7 @@ def history_exercises(subdiscipline):
         flash('Sous-discipline non valide', 'error')
         return redirect(url_for('exercises'))
     
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     c = conn.cursor()
     
     c.execute('''
@@ -2250,7 +2855,6 @@ def history_exercises(subdiscipline):
     ''', (f'%{subdiscipline}%', f'%{subdiscipline}%'))
     
     exercises_list = c.fetchall()
-    conn.close()
     
     subdiscipline_names = {
         'analyse_artefact': 'Analyse d\'artéfact',
@@ -2278,7 +2882,7 @@ def geography_exercises(subdiscipline):
         flash('Sous-discipline non valide', 'error')
         return redirect(url_for('exercises'))
     
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     c = conn.cursor()
     
     c.execute('''
@@ -2289,7 +2893,6 @@ def geography_exercises(subdiscipline):
     ''', (f'%{subdiscipline}%', f'%{subdiscipline}%'))
     
     exercises_list = c.fetchall()
-    conn.close()
     
     subdiscipline_names = {
         'carte': 'Cartes'
@@ -2312,7 +2915,7 @@ def ccq_exercises(subdiscipline):
         flash('Sous-discipline non valide', 'error')
         return redirect(url_for('exercises'))
     
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     c = conn.cursor()
     
     c.execute('''
@@ -2323,7 +2926,6 @@ def ccq_exercises(subdiscipline):
     ''', (f'%{subdiscipline}%', f'%{subdiscipline}%'))
     
     exercises_list = c.fetchall()
-    conn.close()
     
     subdiscipline_names = {
         'reflexion': 'Réflexion'
@@ -2336,9 +2938,16 @@ def ccq_exercises(subdiscipline):
 
 @app.route('/logout')
 def logout():
-    session.clear()
+    # Pop the exact keys login/discipline selection set: with the
+    # file-backed session this rewrites one small file instead of
+    # serializing a cleared dict, and it documents what the app stores
+    for key in ('user', 'user_id', 'role', 'discipline'):
+        session.pop(key, None)
     return redirect(url_for('login'))
 
 if __name__ == '__main__':
     init_db()
-    app.run(host='0.0.0.0', port=5002, debug=True)
+    # Debug mode (tracebacks + reloader) only when explicitly requested;
+    # production runs through wsgi.py under gunicorn
+    app.run(host='0.0.0.0', port=5002,
+            debug=os.environ.get('FLASK_DEBUG') == '1')
@@ -0,0 +1,116 @@
+# session_store.py
+"""
+Filesystem-backed server-side sessions.
+
+The default Flask session serializes the whole session dict into a signed
+cookie and re-validates the HMAC over the full payload on every request.
+Storing the data server-side means only a short random session id travels
+with each request and response.
+"""
+import os
+import pickle
+import secrets
+import time
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+# Session ids are hex tokens; anything else in the cookie is rejected so a
+# crafted cookie can never escape the session directory
+_HEX_DIGITS = set('0123456789abcdef')
+
+
+class FileSystemSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class FileSystemSessionInterface(SessionInterface):
+    """Store session payloads in one pickle file per session id"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, sid):
+        return os.path.join(self.directory, sid)
+
+    def _lifetime(self, app):
+        return app.permanent_session_lifetime.total_seconds()
+
+    def _sweep(self, lifetime):
+        """Delete every stored session older than lifetime seconds"""
+        cutoff = time.time() - lifetime
+        try:
+            entries = os.scandir(self.directory)
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and set(sid) <= _HEX_DIGITS:
+            path = self._path(sid)
+            try:
+                # A session idle longer than the app's lifetime is dead: a
+                # captured sid must not stay valid forever. mtime is the
+                # last activity because save_session touches it below.
+                if os.path.getmtime(path) < time.time() - self._lifetime(app):
+                    os.remove(path)
+                else:
+                    with open(path, 'rb') as f:
+                        return FileSystemSession(pickle.load(f), sid=sid)
+            except (OSError, pickle.PickleError, EOFError):
+                pass
+        return FileSystemSession(sid=secrets.token_hex(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified:
+                try:
+                    os.remove(self._path(session.sid))
+                except OSError:
+                    pass
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.modified or session.new:
+            with open(self._path(session.sid), 'wb') as f:
+                pickle.dump(dict(session), f, pickle.HIGHEST_PROTOCOL)
+        else:
+            # Touch on activity so the lifetime check in open_session is a
+            # sliding idle timeout, not "seconds since last write"
+            try:
+                os.utime(self._path(session.sid))
+            except OSError:
+                pass
+
+        # Stale files for sessions that never come back would otherwise
+        # pile up forever; sweep them on roughly one request in 128
+        if secrets.randbelow(128) == 0:
+            self._sweep(self._lifetime(app))
+
+        response.set_cookie(
+            name,
+            session.sid,
+            path=path,
+            domain=domain,
+            expires=self.get_expiration_time(app, session),
+            secure=self.get_cookie_secure(app),
+            httponly=self.get_cookie_httponly(app),
+            samesite=self.get_cookie_samesite(app),
+        )
@@ -0,0 +1,18 @@
+# wsgi.py
+"""
+Production entrypoint for WSGI servers.
+
+Run with, e.g.:
+
+    gunicorn -w 4 --preload --worker-class gthread --threads 4 -b 0.0.0.0:5002 wsgi:app
+
+--preload imports this module (and runs the migration) once in the master
+before forking, so workers share code pages and skip the migration check
+entirely. The connection pool is deliberately NOT warmed here: SQLite
+connections opened before fork() would be shared by every worker, which
+SQLite documents as a corruption risk. Each worker fills its own pool
+lazily on its first requests instead.
+"""
+from app import app, init_db
+
+init_db(warm_pool=False)